@@ -11,17 +11,14 @@
 import sys
 import os
 import yaml
-from yaml import FullLoader
 import re
 import itertools
-import random
-from functools import reduce
 
 from Pegasus.api import *
 
 from .helper.GeoEDFError import GeoEDFError
 from .helper.WorkflowBuilder import WorkflowBuilder
-from .helper.WorkflowUtils import WorkflowUtils
+from .helper.WorkflowUtils import WorkflowUtils, YamlLoader
 from .helper.WorkflowDBHelper import WorkflowDBHelper
 
 class GeoEDFWorkflow:
@@ -47,8 +44,8 @@ class GeoEDFWorkflow:
         self.helper = WorkflowUtils()
 
         # create a GeoEDF workflow object from the input file
-        with open(workflow_filepath,'r') as workflow_file:
-            self.workflow_dict = yaml.load(workflow_file,Loader=FullLoader)
+        with open(workflow_filepath,'rb') as workflow_file:
+            self.workflow_dict = yaml.load(workflow_file,Loader=YamlLoader)
 
         # validate this workflow
         self.helper.validate_workflow(self.workflow_dict)
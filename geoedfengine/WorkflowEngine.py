@@ -10,11 +10,8 @@
 import sys
 import os
 import yaml
-from yaml import FullLoader
 import re
 import itertools
-import random
-from functools import reduce
 
 from Pegasus.api import *
 
@@ -9,10 +9,7 @@ import sys
 import os
 import yaml
 import re
-import importlib
 import getpass
-import random
-from functools import reduce
 
 from .GeoEDFError import GeoEDFError
 from .WorkflowUtils import WorkflowUtils
@@ -43,6 +40,11 @@ class GeoEDFConnector:
             self.local_file_args = dict()
             self.sensitive_args = dict()
             self.dir_modified_refs = dict()
+            self.plugin_analysis = dict()
+            # analyze the bindings of each plugin once; the results are used
+            # to identify the various dependencies and args below
+            self.analyze_plugins()
+
             # now determine the plugin dependencies (variables and stages)
             # used to drive execution order and construct bindings
             self.identify_plugin_dependencies()
@@ -68,13 +70,13 @@ class GeoEDFConnector:
 
     # validates a plugin's definition dictionary, making sure params are bound just 
     # once and have a binding if included; variables are not also bound params; 
-    # and returns an updated list of unbound variables. 
+    # and returns an updated list (dict keyed by var name) of unbound variables. 
     # Variables are disallowed in post filters or outputs
     # section name is used to provide context for error messages 
     def validate_plugin_def(self,def_dict,bound_params,unbound_vars,section):
         plugin_params = def_dict.keys()
         # check that no param is bound more than once
-        if len(plugin_params) != len(list(set(plugin_params))):
+        if len(plugin_params) != len(set(plugin_params)):
             raise GeoEDFError('Parameters can only be bound once in a plugin')
         for plugin_param in plugin_params:
             param_val = def_dict[plugin_param]
@@ -88,10 +90,10 @@ class GeoEDFConnector:
             if len(param_vars) > 0 and section == 'Output':
                 raise GeoEDFError('Variables not allowed in output plugins')
             else:
-                for var in self.helper.find_dependent_vars(param_val):
+                for var in param_vars:
                     if var in unbound_vars:
                         raise GeoEDFError('Cannot reuse variable: %s' % var)
-                    unbound_vars.append(var)
+                    unbound_vars[var] = None
             # validate any stage references in param value
             # will raise exception if any error
             self.helper.validate_stage_refs(param_val)
@@ -99,8 +101,8 @@ class GeoEDFConnector:
         # check that variables are not also bound parameters
         # have to use names distinct from 'reserved' plugin parameter names
         # first update the set of bound params
-        bound_params += plugin_params
-        if set(bound_params).intersection(set(unbound_vars)):
+        bound_params.update(plugin_params)
+        if not bound_params.isdisjoint(unbound_vars):
             raise GeoEDFError('A variable cannot also be a bound plugin parameter')
 
         return [bound_params,unbound_vars]
@@ -112,24 +114,25 @@ class GeoEDFConnector:
     def validate_params(self):
         # keep a list of vars unbound so far; any new binding has to be of one of these vars
         # since var names cannot be reused across plugins to avoid confusion, one list is sufficient
-        # also keep a list of bound vars to check that all variables have been bound at the end
-        unbound_vars = []
-        bound_vars = []
-        bound_params = []
+        # the list is kept as a dict (ordered, with fast membership checks) keyed by var name
+        # also keep a set of bound vars to check that all variables have been bound at the end
+        # and a set of the plugin params bound so far, to check against the vars
+        unbound_vars = dict()
+        bound_vars = set()
+        bound_params = set()
         
         try:
 
             # each plugin type has its own structure, needs special processing
             # first process the Input plugin
             section = 'Input'
-            for input_plugin in self.__def_dict[section]:
-                [bound_params,unbound_vars] = self.validate_plugin_def(self.__def_dict[section][input_plugin], \
-                                                                       bound_params,unbound_vars,'Input')
+            for input_plugin,input_def in self.__def_dict[section].items():
+                [bound_params,unbound_vars] = self.validate_plugin_def(input_def,bound_params,unbound_vars,'Input')
             # then the Filter (if it exists)
             section = 'Filter'
             # some of these params can be input params
             if section in self.__def_dict:
-                for filtered_param in self.__def_dict[section]:
+                for filtered_param,param_filters in self.__def_dict[section].items():
                     # if an input param bound by a filter was already bound in the input definition, then raise error
                     #if filtered_param not in unbound_vars:
                     #    raise GeoEDFError('Only variables can be bound by a filter: %s' % filtered_param)
@@ -137,13 +140,11 @@ class GeoEDFConnector:
                     if filtered_param in bound_vars:
                         raise GeoEDFError('A variable can only be bound once by a filter: %s' % filtered_param)
                     else: # add this to the set of bound variables
-                        bound_vars.append(filtered_param)
+                        bound_vars.add(filtered_param)
                             
                     # get this parameter's filter definition
-                    for param_pre_filter in self.__def_dict[section][filtered_param]:
-                        [bound_params,unbound_vars] = self.validate_plugin_def( \
-                                                            self.__def_dict[section][filtered_param][param_pre_filter], \
-                                                            bound_params,unbound_vars,'Filter')
+                    for param_pre_filter,filter_def in param_filters.items():
+                        [bound_params,unbound_vars] = self.validate_plugin_def(filter_def,bound_params,unbound_vars,'Filter')
 
             # make sure all variables have been bound
             if len(bound_vars) != len(unbound_vars):
@@ -192,6 +193,17 @@ class GeoEDFConnector:
                 if not stage_ref_num < workflow_stage:
                     raise GeoEDFError('Invalid stage reference $%d in workflow stage $%d' % (stage_ref_num,workflow_stage))
 
+    # analyze the bindings of the input and filter plugins
+    # creates a dictionary mapping plugin ID to its PluginAnalysis
+    def analyze_plugins(self):
+        self.plugin_analysis['Input'] = self.helper.analyze_plugin(self.__def_dict['Input'])
+
+        # do we have any filters?
+        if 'Filter' in self.__def_dict:
+            for filtered_param in self.__def_dict['Filter']:
+                filter_id = 'Filter:%s' % filtered_param
+                self.plugin_analysis[filter_id] = self.helper.analyze_plugin(self.__def_dict['Filter'][filtered_param])
+
     # determine plugin dependencies (mainly variable-filter chains)
     # encode as a dictionary of dependencies, keyed by stage identifiers
     # also collect stage references and (class) names of plugins
@@ -207,10 +219,10 @@ class GeoEDFConnector:
         self.plugin_names['Input'] = list(input_def.keys())[0]
 
         # what vars does the Input plugin depend on
-        self.var_dependencies['Input'] = self.helper.collect_var_dependencies(input_def)
+        self.var_dependencies['Input'] = self.plugin_analysis['Input'].var_deps
 
         # which prior stages does the Input plugin reference
-        self.stage_refs['Input'] = self.helper.collect_stage_refs(input_def)
+        self.stage_refs['Input'] = self.plugin_analysis['Input'].stage_refs
 
         # do we have any filters?
         if 'Filter' in self.__def_dict:
@@ -227,84 +239,68 @@ class GeoEDFConnector:
                 self.var_filter[filtered_param] = filter_id
 
                 # what vars does this filter depend on
-                self.var_dependencies[filter_id] = self.helper.collect_var_dependencies(filter_def)
+                self.var_dependencies[filter_id] = self.plugin_analysis[filter_id].var_deps
 
                 # stages referenced by this filter
-                self.stage_refs[filter_id] = self.helper.collect_stage_refs(filter_def)
+                self.stage_refs[filter_id] = self.plugin_analysis[filter_id].stage_refs
 
         # the only dependencies can be filter plugins
         # loop through input and filter plugins
 
         # first the input
-        self.plugin_dependencies['Input'] = []
-
         # this should work since we have already validated the definition
         # there can't be any unbound variables
-        for var in self.var_dependencies['Input']:
-            self.plugin_dependencies['Input'].append(self.var_filter[var])
+        # each var is bound by exactly one filter, so there are no duplicates
+        self.plugin_dependencies['Input'] = [self.var_filter[var] for var in self.var_dependencies['Input']]
 
         # next each filter
         for filtered_var in self.var_filter.keys():
             filter_id = 'Filter:%s' % filtered_var
-            self.plugin_dependencies[filter_id] = []
-            for dep_var in self.var_dependencies[filter_id]:
-                self.plugin_dependencies[filter_id].append(self.var_filter[dep_var])
+            self.plugin_dependencies[filter_id] = [self.var_filter[dep_var] for dep_var in self.var_dependencies[filter_id]]
 
     # determine args bound to local files for each plugin
     # creates a dictionary mapping arg to file
     def identify_local_file_args(self):
-        input_def = self.__def_dict['Input']
-
         # what args are bound to local files in Input plugin
-        self.local_file_args['Input'] = self.helper.collect_local_file_bindings(input_def)
+        self.local_file_args['Input'] = self.plugin_analysis['Input'].local_file_binds
 
         # do we have any filters?
         if 'Filter' in self.__def_dict:
             for filtered_param in self.__def_dict['Filter']:
-                filter_def = self.__def_dict['Filter'][filtered_param]
-
                 # construct Filter ID
                 filter_id = 'Filter:%s' % filtered_param
 
                 # what args in Filter are bound to local files
-                self.local_file_args[filter_id] = self.helper.collect_local_file_bindings(filter_def)
+                self.local_file_args[filter_id] = self.plugin_analysis[filter_id].local_file_binds
 
     # determine args with an empty binding
     # creates a dictionary mapping plugin ID to list of such args
     def identify_sensitive_args(self):
-        input_def = self.__def_dict['Input']
-
         # what args are left blank in the Input plugin
-        self.sensitive_args['Input'] = self.helper.collect_empty_bindings(input_def)
+        self.sensitive_args['Input'] = self.plugin_analysis['Input'].empty_args
 
         # do we have any filters?
         if 'Filter' in self.__def_dict:
             for filtered_param in self.__def_dict['Filter']:
-                filter_def = self.__def_dict['Filter'][filtered_param]
-
                 # construct Filter ID
                 filter_id = 'Filter:%s' % filtered_param
 
                 # what args in Filter are bound to local files
-                self.sensitive_args[filter_id] = self.helper.collect_empty_bindings(filter_def)
+                self.sensitive_args[filter_id] = self.plugin_analysis[filter_id].empty_args
 
     # determine stage references with dir modifier applied to them
     # creates a dictionary mapping plugin ID to list of such stage refs
     def identify_dir_modified_args(self):
-        input_def = self.__def_dict['Input']
-
         # what refs have dir modifiers applied to them
-        self.dir_modified_refs['Input'] = self.helper.collect_dir_modified_refs(input_def)
+        self.dir_modified_refs['Input'] = self.plugin_analysis['Input'].dir_mod_refs
 
         # do we have any filters?
         if 'Filter' in self.__def_dict:
             for filtered_param in self.__def_dict['Filter']:
-                filter_def = self.__def_dict['Filter'][filtered_param]
-
                 # construct Filter ID
                 filter_id = 'Filter:%s' % filtered_param
 
                 # what args in Filter have dir modifiers in value
-                self.dir_modified_refs[filter_id] = self.helper.collect_dir_modified_refs(filter_def)
+                self.dir_modified_refs[filter_id] = self.plugin_analysis[filter_id].dir_mod_refs
 
             
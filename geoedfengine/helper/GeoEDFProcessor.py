@@ -9,10 +9,7 @@ import sys
 import os
 import yaml
 import re
-import importlib
 import getpass
-import random
-from functools import reduce
 
 from .GeoEDFError import GeoEDFError
 from .WorkflowUtils import WorkflowUtils
@@ -33,13 +30,15 @@ class GeoEDFProcessor:
         # validate the definition
         # will raise an exception if this fails
         if self.validate_definition():
+            # analyze the bindings in one pass
+            proc_analysis = self.helper.analyze_plugin(self.__def_dict)
             # now determine the prior workflow stage references and args bound to local files
-            self.stage_refs = self.helper.collect_stage_refs(self.__def_dict)
+            self.stage_refs = proc_analysis.stage_refs
             # validate stage references
             self.validate_stage_refs(workflow_stage)
-            self.local_file_args = self.helper.collect_local_file_bindings(self.__def_dict)
-            self.sensitive_args = self.helper.collect_empty_bindings(self.__def_dict)
-            self.dir_modified_refs = self.helper.collect_dir_modified_refs(self.__def_dict)
+            self.local_file_args = proc_analysis.local_file_binds
+            self.sensitive_args = proc_analysis.empty_args
+            self.dir_modified_refs = proc_analysis.dir_mod_refs
         else:
             raise GeoEDFError('Processor fails validation!')
 
@@ -61,7 +60,7 @@ class GeoEDFProcessor:
         plugin_params = self.proc_def.keys()
         
         # check that no param is bound more than once
-        if len(plugin_params) != len(list(set(plugin_params))):
+        if len(plugin_params) != len(set(plugin_params)):
             raise GeoEDFError('Parameters can only be bound once in a plugin')
         for plugin_param in plugin_params:
             param_val = self.proc_def[plugin_param]
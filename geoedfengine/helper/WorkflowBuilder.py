@@ -10,12 +10,13 @@
 import sys
 import os
 import yaml
-from yaml import FullLoader
 import json
 import re
 
+from collections import deque
+
 from .GeoEDFError import GeoEDFError
-from .WorkflowUtils import WorkflowUtils
+from .WorkflowUtils import WorkflowUtils, YamlLoader
 from .GeoEDFConnector import GeoEDFConnector
 from .GeoEDFProcessor import GeoEDFProcessor
 
@@ -33,8 +34,8 @@ class WorkflowBuilder:
     # mode is between prod,standalone, and dev; in dev mode, local containers are allowed
 
     def __init__(self,workflow_filename,mode='prod',target='condorpool'):
-        with open(workflow_filename,'r') as workflow_file:
-            self.workflow_dict = yaml.load(workflow_file,Loader=FullLoader)
+        with open(workflow_filename,'rb') as workflow_file:
+            self.workflow_dict = yaml.load(workflow_file,Loader=YamlLoader)
         self.workflow_filename = workflow_filename
         self.target = target
 
@@ -433,128 +434,135 @@ class WorkflowBuilder:
 
         plugins = list(conn_inst.plugin_dependencies.keys())
 
+        # number of yet unprocessed dependencies of each plugin, and the
+        # reverse mapping from a plugin to the plugins that depend on it
+        pending_deps = dict()
+        dependents = dict((plugin_id,[]) for plugin_id in plugins)
+        for plugin_id in plugins:
+            plugin_deps = conn_inst.plugin_dependencies[plugin_id]
+            pending_deps[plugin_id] = len(plugin_deps)
+            for dep_plugin in plugin_deps:
+                dependents[dep_plugin].append(plugin_id)
+
+        # plugins that are fully bound and can be processed right away
+        ready = deque(plugin_id for plugin_id in plugins if pending_deps[plugin_id] == 0)
+
         # dictionary of jobs keyed by plugin id to set up dependencies
         plugin_jobs = dict()
 
-        # while plugins still exist
-        while len(plugins) > 0:
+        # process plugins as they become fully bound, creating their jobs
+        # manage dependencies for these jobs, essentially vars + prior stage
+        while len(ready) > 0:
+            plugin_id = ready.popleft()
 
-            plugins_done = []
-                    
-            # find ones that are fully bound and create jobs
-            # manage dependencies for these jobs, essentially vars + prior stage
-            for plugin_id in plugins:
-                fully_bound = True
-                for dep_plugin in conn_inst.plugin_dependencies[plugin_id]:
-                    # dependency not yet bound, skip
-                    if dep_plugin in plugins:
-                        fully_bound = False
-                        break
+            # look up this plugin's bindings once for the rest of the loop body
+            plugin_name = conn_inst.plugin_names[plugin_id]
+            plugin_var_deps = conn_inst.var_dependencies[plugin_id]
+            plugin_stage_refs = conn_inst.stage_refs[plugin_id]
+            plugin_local_file_args = conn_inst.local_file_args[plugin_id]
+
+            # if this plugin has any sensitive args, prompt the user for values
+            # gets a JSON back
+            plugin_sensitive_args = conn_inst.sensitive_args[plugin_id]
+            if len(plugin_sensitive_args) > 0:
+                sensitive_arg_binds = self.helper.collect_sensitive_arg_binds(stage_num,plugin_name,plugin_sensitive_args)
+                sensitive_arg_binds_str = json.dumps(json.dumps(sensitive_arg_binds))
+            else:
+                sensitive_arg_binds_str = 'None'
+
+            # file to hold the subdax for this plugin
+            # if filter
+            if ':' in plugin_id:
+                stage_name = 'stage-%d-Filter-%s' % (stage_num,plugin_id.split(':')[1])
+            else: #input
+                stage_name = 'stage-%d-Input' % stage_num
+                            
+            subdax_filename = '%s.yml' % stage_name
+
+            # add subdax file to DAX
+            subdax_file = File(subdax_filename)
+            #subdax_filepath = '%s/%s' % (self.run_dir, subdax_filename)
+            #self.rc.add_replica("local",subdax_file,subdax_filepath)
+
+            # construct subdax for this plugin, then create a job to execute this subdax
+            try:
+                # job constructing subdax for this stage
+                # stage reference and var values files are needed as input
+                dep_vars_str = self.helper.list_to_str(plugin_var_deps)
+                stage_refs_str = self.helper.list_to_str(plugin_stage_refs)
+
+                dep_var_files = []
+                stage_ref_files = []
+
+                # create files for the results of the dependent vars and referenced stages
+                for dep_var in plugin_var_deps:
+                    dep_var_file = File('results_%d_%s.txt' % (stage_num,dep_var))
+                    dep_var_files.append(dep_var_file)
+
+                for stage_ref in plugin_stage_refs:
+                    stage_ref_file = File('results_%s.txt' % stage_ref)
+                    stage_ref_files.append(stage_ref_file) 
+
+                # if local args dictionary is empty
+                if not plugin_local_file_args:
+                    local_file_args_str = 'None'
+                else:
+                    local_file_args_str = json.dumps(json.dumps(plugin_local_file_args))
+                # stage refs with dir modifiers
+                dir_mod_refs_str = self.helper.list_to_str(conn_inst.dir_modified_refs[plugin_id])
                 
-                # can't process this plugin yet, try another
-                if not fully_bound:
-                    continue
-            
-                # plugin can be executed, create a subdax for this plugin
-                plugins_done.append(plugin_id)
-
-                # if this plugin has any sensitive args, prompt the user for values
-                # gets a JSON back
-                plugin_sensitive_args = conn_inst.sensitive_args[plugin_id]
-                if len(plugin_sensitive_args) > 0:
-                    sensitive_arg_binds = self.helper.collect_sensitive_arg_binds(stage_num,conn_inst.plugin_names[plugin_id],plugin_sensitive_args)
-                    sensitive_arg_binds_str = json.dumps(json.dumps(sensitive_arg_binds))
+                stage_id = '%d' % stage_num
+                if ':' in plugin_id:
+                    res_filename = 'results_%d_%s.txt' % (stage_num,plugin_id.split(':')[1])
                 else:
-                    sensitive_arg_binds_str = 'None'
+                    res_filename = 'results_%d.txt' % stage_num
+                stage_res_file = File(res_filename)
 
-                # file to hold the subdax for this plugin
-                # if filter
-                if ':' in plugin_id:
-                    stage_name = 'stage-%d-Filter-%s' % (stage_num,plugin_id.split(':')[1])
-                else: #input
-                    stage_name = 'stage-%d-Input' % stage_num
-                                
-                subdax_filename = '%s.yml' % stage_name
-
-                # add subdax file to DAX
-                subdax_file = File(subdax_filename)
-                #subdax_filepath = '%s/%s' % (self.run_dir, subdax_filename)
-                #self.rc.add_replica("local",subdax_file,subdax_filepath)
-
-                # construct subdax for this plugin, then create a job to execute this subdax
-                try:
-                    # job constructing subdax for this stage
-                    # stage reference and var values files are needed as input
-                    dep_vars_str = self.helper.list_to_str(conn_inst.var_dependencies[plugin_id])
-                    stage_refs_str = self.helper.list_to_str(conn_inst.stage_refs[plugin_id])
-
-                    dep_var_files = []
-                    stage_ref_files = []
-
-                    # create files for the results of the dependent vars and referenced stages
-                    for dep_var in conn_inst.var_dependencies[plugin_id]:
-                        dep_var_file = File('results_%d_%s.txt' % (stage_num,dep_var))
-                        dep_var_files.append(dep_var_file)
-
-                    for stage_ref in conn_inst.stage_refs[plugin_id]:
-                        stage_ref_file = File('results_%s.txt' % stage_ref)
-                        stage_ref_files.append(stage_ref_file) 
-
-                    # if local args dictionary is empty
-                    if not conn_inst.local_file_args[plugin_id]:
-                        local_file_args_str = 'None'
-                    else:
-                        local_file_args_str = json.dumps(json.dumps(conn_inst.local_file_args[plugin_id]))
-                    # stage refs with dir modifiers
-                    dir_mod_refs_str = self.helper.list_to_str(conn_inst.dir_modified_refs[plugin_id])
-                    
-                    stage_id = '%d' % stage_num
-                    if ':' in plugin_id:
-                        res_filename = 'results_%d_%s.txt' % (stage_num,plugin_id.split(':')[1])
-                    else:
-                        res_filename = 'results_%d.txt' % stage_num
-                    stage_res_file = File(res_filename)
+                subdax_job = self.construct_plugin_subdax(stage_id, subdax_filename, plugin_id, plugin_name, dep_vars_str, stage_refs_str,local_file_args_str, sensitive_arg_binds_str, dir_mod_refs_str, dep_var_files, stage_ref_files)
+                subdax_job.add_outputs(subdax_file,stage_out=False,register_replica=False)
+                self.geoedf_wf.add_jobs(subdax_job)
 
-                    plugin_name = conn_inst.plugin_names[plugin_id]
-                    subdax_job = self.construct_plugin_subdax(stage_id, subdax_filename, plugin_id, plugin_name, dep_vars_str, stage_refs_str,local_file_args_str, sensitive_arg_binds_str, dir_mod_refs_str, dep_var_files, stage_ref_files)
-                    subdax_job.add_outputs(subdax_file,stage_out=False,register_replica=False)
-                    self.geoedf_wf.add_jobs(subdax_job)
+                # add dependencies; mkdir job and any var dependencies
+                self.geoedf_wf.add_dependency(subdax_job,parents=[stage_mkdir_job])
+                            
+                # dependencies on filters
+                for dep_plugin_id in conn_inst.plugin_dependencies[plugin_id]:
+                    self.geoedf_wf.add_dependency(subdax_job,parents=[plugin_jobs[dep_plugin_id]])
 
-                    # add dependencies; mkdir job and any var dependencies
-                    self.geoedf_wf.add_dependency(subdax_job,parents=[stage_mkdir_job])
-                                
-                    # dependencies on filters
-                    for dep_plugin_id in conn_inst.plugin_dependencies[plugin_id]:
-                        self.geoedf_wf.add_dependency(subdax_job,parents=[plugin_jobs[dep_plugin_id]])
-
-                    # add job executing sub-workflow to DAX
-                    subdax_exec_job = SubWorkflow(subdax_file, is_planned=False)
-                    #output_dir = '%s/output' % self.run_dir
-
-                    subdax_exec_job.add_args("-Dpegasus.integrity.checking=none",
-                                             "--sites",self.target,
-                                             "--output-site","local",
-                                             "--basename",stage_name,
-                                             "--force")
-                    subdax_exec_job.add_outputs(stage_res_file,stage_out=False,register_replica=False)
-                    self.geoedf_wf.add_jobs(subdax_exec_job)
-                    # add dependency between job building subdax and job executing it
-                    self.geoedf_wf.add_dependency(subdax_exec_job,parents=[subdax_job])
-
-                    # if this is an Input plugin, make it the leaf of this stage
-                    if plugin_id == 'Input':
-                        self.leaf_job = subdax_exec_job
-
-                    # update job dictionary
-                    plugin_jobs[plugin_id] = subdax_exec_job
-                                
-                except Exception as e:
-                    raise GeoEDFError("Error constructing sub-workflow for plugin %s: %s" % (plugin_id,e))
-                                                         
-            # update plugins list
-            for plugin_id in plugins_done:
-                # remove from plugins
-                plugins.remove(plugin_id)
+                # add job executing sub-workflow to DAX
+                subdax_exec_job = SubWorkflow(subdax_file, is_planned=False)
+                #output_dir = '%s/output' % self.run_dir
+
+                subdax_exec_job.add_args("-Dpegasus.integrity.checking=none",
+                                         "--sites",self.target,
+                                         "--output-site","local",
+                                         "--basename",stage_name,
+                                         "--force")
+                subdax_exec_job.add_outputs(stage_res_file,stage_out=False,register_replica=False)
+                self.geoedf_wf.add_jobs(subdax_exec_job)
+                # add dependency between job building subdax and job executing it
+                self.geoedf_wf.add_dependency(subdax_exec_job,parents=[subdax_job])
+
+                # if this is an Input plugin, make it the leaf of this stage
+                if plugin_id == 'Input':
+                    self.leaf_job = subdax_exec_job
+
+                # update job dictionary
+                plugin_jobs[plugin_id] = subdax_exec_job
+                            
+            except Exception as e:
+                raise GeoEDFError("Error constructing sub-workflow for plugin %s: %s" % (plugin_id,e))
+
+            # plugins depending on this one may now be fully bound
+            for dep_plugin in dependents[plugin_id]:
+                pending_deps[dep_plugin] -= 1
+                if pending_deps[dep_plugin] == 0:
+                    ready.append(dep_plugin)
+
+        # any plugin not processed is part of a dependency cycle
+        if len(plugin_jobs) < len(plugins):
+            unbound = [plugin_id for plugin_id in plugins if plugin_id not in plugin_jobs]
+            raise GeoEDFError("Circular variable dependencies between plugins %s in stage %d" % (','.join(unbound),stage_num))
 
     # constructs the subdax and its executor job for a processor in the workflow
     def construct_proc_subdax(self,stage_num,workflow_stage,stage_mkdir_job):
@@ -8,10 +8,51 @@
 import sys
 import os
 import sqlite3
+import itertools
+import threading
 from .GeoEDFError import GeoEDFError
 
 class WorkflowDBHelper:
 
+    # SQLite connections are opened once per thread and GeoEDF workflow DB file and
+    # shared by all helper instances in that thread, so that the table setup and statement
+    # caches are reused across calls; sqlite3 connections cannot be used across threads
+    # keying by DB file picks up a change of $HOME in a long-lived session
+    # the Pegasus master workflow DB is attached to a connection as "pegasus"
+    _thread_cons = threading.local()
+
+    # returns this thread's dictionaries of connections and attached Pegasus DBs,
+    # both keyed by GeoEDF workflow DB file
+    @classmethod
+    def thread_cons(cls):
+        if not hasattr(cls._thread_cons,'geoedf_cons'):
+            cls._thread_cons.geoedf_cons = dict()
+            cls._thread_cons.pegasus_attached = set()
+        return (cls._thread_cons.geoedf_cons,cls._thread_cons.pegasus_attached)
+
+    # returns the shared connection to this GeoEDF workflow DB, creating the DB file
+    # and geoedf_workflow table if not exist
+    @classmethod
+    def get_geoedf_con(cls,geoedf_dbfile):
+        (geoedf_cons,pegasus_attached) = cls.thread_cons()
+        if geoedf_dbfile not in geoedf_cons:
+            con = sqlite3.connect(geoedf_dbfile)
+            con.row_factory = sqlite3.Row
+            con.execute('''CREATE TABLE if not exists geoedf_workflow(wfid INTEGER PRIMARY KEY AUTOINCREMENT, workflow_name TEXT NOT NULL, pegasus_workflow_name TEXT NOT NULL, workflow_rundir TEXT NOT NULL, tool_shortname TEXT NOT NULL, UNIQUE(workflow_name))''')
+            geoedf_cons[geoedf_dbfile] = con
+        return geoedf_cons[geoedf_dbfile]
+
+    # attaches the Pegasus master workflow DB to the shared connection for this
+    # GeoEDF workflow DB; only attached if the DB file exists, to avoid creating an empty one
+    # returns whether the DB is attached
+    @classmethod
+    def attach_pegasus_db(cls,geoedf_dbfile,pegasus_dbfile):
+        (geoedf_cons,pegasus_attached) = cls.thread_cons()
+        if geoedf_dbfile not in pegasus_attached and os.path.isfile(pegasus_dbfile):
+            geoedf_cons[geoedf_dbfile].execute("ATTACH DATABASE ? AS pegasus",(pegasus_dbfile,))
+            pegasus_attached.add(geoedf_dbfile)
+        return geoedf_dbfile in pegasus_attached
+
     # initialize class object
     # create the db file and geoedf_workflow table if not exist
     def __init__(self):
@@ -19,29 +60,27 @@ class WorkflowDBHelper:
         # initialize key variables
         self.geoedf_cursor = None
         self.geoedf_con = None
-        self.pegasus_cursor = None
+        self.geoedf_dbfile = None
+        self.pegasus_attached = False
 
         # HUBzero specific; assume workflow DB file is in home directory
         if os.getenv('HOME') is not None:
             # geoedf workflow DB file path
             geoedf_dbfile = '%s/geoedf(DO_NOT_DELETE).db' % os.getenv('HOME')
             try:
-                con = sqlite3.connect(geoedf_dbfile)
-                con.row_factory = sqlite3.Row
+                con = WorkflowDBHelper.get_geoedf_con(geoedf_dbfile)
+                self.geoedf_dbfile = geoedf_dbfile
                 self.geoedf_con = con
                 self.geoedf_cursor = con.cursor()
-                self.geoedf_cursor.execute('''CREATE TABLE if not exists geoedf_workflow(wfid INTEGER PRIMARY KEY AUTOINCREMENT, workflow_name TEXT NOT NULL, pegasus_workflow_name TEXT NOT NULL, workflow_rundir TEXT NOT NULL, tool_shortname TEXT NOT NULL, UNIQUE(workflow_name))''')
             except:
                 raise GeoEDFError("Error initializing GeoEDF workflow database")
 
             # Pegasus workflow DB file path
             pegasus_dbfile = '%s/.pegasus/workflow.db' % os.getenv('HOME')
             try:
-                con = sqlite3.connect(pegasus_dbfile)
-                con.row_factory = sqlite3.Row
-                self.pegasus_cursor = con.cursor()
+                self.pegasus_attached = WorkflowDBHelper.attach_pegasus_db(geoedf_dbfile,pegasus_dbfile)
             except:
-                self.pegasus_cursor = None
+                self.pegasus_attached = False
                 #raise GeoEDFError("Error initializing Pegasus master workflow database")
 
         else:
@@ -52,8 +91,8 @@ class WorkflowDBHelper:
     def check_unique_workflow(self,workflow_name):
         if self.geoedf_cursor is not None:
             # check to see if workflow with this name already exists
-            validate_querystr = "SELECT * from geoedf_workflow WHERE workflow_name = '%s';" % workflow_name
-            validate_res = self.query(self.geoedf_cursor,validate_querystr)
+            validate_querystr = "SELECT * from geoedf_workflow WHERE workflow_name = ?;"
+            validate_res = self.query(self.geoedf_cursor,validate_querystr,(workflow_name,))
             if len(validate_res) > 0:
                 raise GeoEDFError("A workflow with the name '%s' already exists; please choose a different name" % workflow_name)
         else:
@@ -63,18 +102,19 @@ class WorkflowDBHelper:
     def insert_workflow(self,workflow_name,pegasus_workflow_name,workflow_rundir,tool_shortname):
         if self.geoedf_cursor is not None:
             # insert workflow record
-            self.geoedf_cursor.execute("INSERT OR IGNORE INTO geoedf_workflow(workflow_name, pegasus_workflow_name, workflow_rundir, tool_shortname) VALUES('%s','%s','%s','%s')" % (workflow_name,pegasus_workflow_name,workflow_rundir,tool_shortname))
+            # bind values as parameters so the statement text is constant across calls
+            self.geoedf_cursor.execute("INSERT OR IGNORE INTO geoedf_workflow(workflow_name, pegasus_workflow_name, workflow_rundir, tool_shortname) VALUES(?,?,?,?)", (workflow_name,pegasus_workflow_name,workflow_rundir,tool_shortname))
             self.geoedf_con.commit()
         else:
             raise GeoEDFError("Cannot execute commands against GeoEDF workflow database!!!")
 
-    # method to query a table given a SQLite cursor and return a dict
-    def query(self,cursor,query_str):
+    # method to query a table given a SQLite cursor and return the rows
+    # params are bound to any ? placeholders in the query string
+    # connections use sqlite3.Row, so rows can be accessed by column name
+    def query(self,cursor,query_str,params=()):
         try:
-            cursor.execute(query_str)
-            res = cursor.fetchall()
-            data = [dict(row) for row in res]
-            return data
+            cursor.execute(query_str,params)
+            return cursor.fetchall()
         except:
             raise GeoEDFError("Error occurred executing query %s" % query_str)
 
@@ -106,58 +146,43 @@ class WorkflowDBHelper:
             con.row_factory = sqlite3.Row
             workflow_cursor = con.cursor()
 
-            task_querystr = "SELECT transformation,argv,job_id from task where transformation like 'build_%_plugin_subdax' or transformation like 'run%plugin%';"
+            # fetch each task along with the states of its (first) job instance in one query
+            # rows are ordered by task so that the job states can be grouped per task
+            # GLOB patterns have a literal prefix, letting SQLite turn them into range scans
+            task_querystr = "SELECT t.task_id,t.transformation,t.argv,t.job_id,ji.job_instance_id,js.state from task t LEFT JOIN job_instance ji ON ji.job_instance_id = (SELECT MIN(job_instance_id) from job_instance where job_id = t.job_id) LEFT JOIN jobstate js ON js.job_instance_id = ji.job_instance_id where t.transformation GLOB 'build_*_plugin_subdax' or t.transformation GLOB 'run*plugin*' ORDER BY t.task_id;"
+
+            task_rows = self.query(workflow_cursor,task_querystr)
 
-            task_jobs = self.query(workflow_cursor,task_querystr)
+            task_jobs = [list(group) for (task_rowid,group) in itertools.groupby(task_rows,key=lambda row: row['task_id'])]
 
             num_tasks = len(task_jobs)
 
-            # for each task job, get the job instance ID, then query its states
-            for task_job in task_jobs:
-                task_jobid = task_job['job_id']
+            # for each task job, check the states of its job instance
+            for task_job_rows in task_jobs:
+                task_job = task_job_rows[0]
                 task_transformation = task_job['transformation']
-                task_data = task_job['argv'].split(' ')
-                task_stage = task_data[1]
-                task_plugin = task_data[2]
-
-                if task_transformation.startswith('build'):
-                    task_id = '%s:%s' % (task_stage,task_plugin)
-                else: #running tasks
-                    if ':' in task_stage:
-                        task_id = task_stage
-                    else:
-                        task_id = '%s:%s' % (task_stage,task_plugin)
-
-                job_instid_querystr = "SELECT job_instance_id from job_instance where job_id = %d;" % int(task_jobid)
-
-                task_jobinst = self.query(workflow_cursor,job_instid_querystr)
-
-                # assuming there only exists one
-                if len(task_jobinst) > 0:
-                    job_instid = int(task_jobinst[0]['job_instance_id'])
-
-                    # get states
-                    job_state_querystr = "SELECT state from jobstate where job_instance_id = %d;" % job_instid
-
-                    job_states_res = self.query(workflow_cursor,job_state_querystr)
-
-                    if len(job_states_res) > 0:
-                        # check to see if JOB_SUCCESS and POST_SCRIPT_SUCCESS are present
-                        # if so, this task is done, so continue
-                        # if not, then this is the one being executed
-                        job_states = [row['state'] for row in job_states_res]
-                        if 'JOB_SUCCESS' in job_states:
-                            if 'POST_SCRIPT_FAILED' in job_states:
-                                failed_tasks.append(task_id)
-                            elif 'POST_SCRIPT_SUCCESS' in job_states:
-                                complete_tasks.append(task_id)
-                            else:
-                                executing_tasks.append(task_id)
+                # only the stage and plugin (2nd and 3rd args) are needed
+                (_,task_stage,task_plugin,*_) = task_job['argv'].split(None,3)
+
+                task_id = self.get_task_id(task_transformation,task_stage,task_plugin)
+
+                # states are NULL if there is no job instance or it has no states yet
+                job_states = [row['state'] for row in task_job_rows if row['state'] is not None]
+
+                if len(job_states) > 0:
+                    # check to see if JOB_SUCCESS and POST_SCRIPT_SUCCESS are present
+                    # if so, this task is done, so continue
+                    # if not, then this is the one being executed
+                    if 'JOB_SUCCESS' in job_states:
+                        if 'POST_SCRIPT_FAILED' in job_states:
+                            failed_tasks.append(task_id)
+                        elif 'POST_SCRIPT_SUCCESS' in job_states:
+                            complete_tasks.append(task_id)
                         else:
-                            #this task is still being worked on
                             executing_tasks.append(task_id)
                     else:
-                        pending_tasks.append(task_id)
+                        #this task is still being worked on
+                        executing_tasks.append(task_id)
                 else:
                     pending_tasks.append(task_id)
 
@@ -169,6 +194,13 @@ class WorkflowDBHelper:
         except:
             raise GeoEDFError("Exception occurred when trying to determine current workflow task!!!")
 
+    # construct a task ID of the form stage:plugin for a build- or run- task
+    # run tasks already encode the plugin in their stage arg when it contains a :
+    def get_task_id(self,task_transformation,task_stage,task_plugin):
+        if not task_transformation.startswith('build') and ':' in task_stage:
+            return task_stage
+        return '%s:%s' % (task_stage,task_plugin)
+
     # make a human readable task name
     def human_readable_taskname(self,task):
         task_data = task.split(':')
@@ -222,70 +254,52 @@ class WorkflowDBHelper:
     # are retrieved
     def get_workflow_status(self,workflow_name=None,tool_shortname=None):
         status_res = []
-        rundirs = {}
-        pegasus_workflows = {}
-        dax_workflownames = {}
-        
-        if workflow_name is None:
-            # query for all workflow names for this tool_shortname
-            # if unknown, query all workflows
-            if tool_shortname is None:
-                get_wf_names_query_str = "SELECT workflow_name,pegasus_workflow_name,workflow_rundir from geoedf_workflow;"
-            else:
-                get_wf_names_query_str = "SELECT workflow_name,pegasus_workflow_name,workflow_rundir from geoedf_workflow WHERE tool_shortname = '%s';" % tool_shortname
-        else: #workflow name has been provided; still need to query for rundir
-            if tool_shortname is None:
-                get_wf_names_query_str = "SELECT workflow_name,pegasus_workflow_name,workflow_rundir from geoedf_workflow WHERE workflow_name = '%s';" % workflow_name
-            else:
-                get_wf_names_query_str = "SELECT workflow_name,pegasus_workflow_name,workflow_rundir from geoedf_workflow WHERE tool_shortname = '%s' AND workflow_name = '%s';" % (tool_shortname,workflow_name)
 
-        res = self.query(self.geoedf_cursor,get_wf_names_query_str)
-            
-        workflow_names = ['%s' % row['workflow_name'] for row in res]
+        # filters on tool_shortname and workflow_name are skipped when they are None
+        wf_filter_str = "WHERE (? IS NULL OR g.tool_shortname = ?) AND (? IS NULL OR g.workflow_name = ?)"
+        wf_filter_params = (tool_shortname,tool_shortname,workflow_name,workflow_name)
 
-        for row in res:
-            rundirs[row['workflow_name']] = row['workflow_rundir']
-            pegasus_workflows[row['workflow_name']] = row['pegasus_workflow_name']
-            dax_workflownames[row['pegasus_workflow_name']] = row['workflow_name']
+        # first check for matching workflows; the Pegasus DB only exists once
+        # a workflow has been planned, so it is not needed if there are none
+        get_wf_names_query_str = "SELECT g.workflow_name FROM geoedf_workflow g %s;" % wf_filter_str
 
-        # for each workflow, query the Pegasus master_workflow table to fetch db_url
-        # query string is different based on the number of workflow names
-        if len(workflow_names) == 0:
+        res = self.query(self.geoedf_cursor,get_wf_names_query_str,wf_filter_params)
+
+        if len(res) == 0:
             print("No workflows found")
             return status_res
-        elif len(workflow_names) == 1:
-            get_wf_db_url_query_str = "SELECT dax_label,db_url FROM master_workflow WHERE dax_label in ('%s');" % pegasus_workflows[workflow_names[0]]
-        else:
-            get_wf_db_url_query_str = "SELECT dax_label,db_url FROM master_workflow WHERE dax_label in %s;" % (tuple([pegasus_workflows[workflow_name] for workflow_name in workflow_names]),)
 
-        if self.pegasus_cursor is None:
+        if not self.pegasus_attached:
             pegasus_dbfile = '%s/.pegasus/workflow.db' % os.getenv('HOME')
             try:
-                con = sqlite3.connect(pegasus_dbfile)
-                con.row_factory = sqlite3.Row
-                self.pegasus_cursor = con.cursor()
+                self.pegasus_attached = WorkflowDBHelper.attach_pegasus_db(self.geoedf_dbfile,pegasus_dbfile)
             except:
-                raise GeoEDFError('Still could not construct pegasus DB cursor')
-            
-        res = self.query(self.pegasus_cursor,get_wf_db_url_query_str)
+                self.pegasus_attached = False
+            if not self.pegasus_attached:
+                raise GeoEDFError('Still could not attach pegasus DB')
+
+        # fetch the rundir and the Pegasus master_workflow db_url of each workflow in one query
+        get_wf_status_query_str = "SELECT g.workflow_name,g.workflow_rundir,m.db_url FROM geoedf_workflow g JOIN pegasus.master_workflow m ON m.dax_label = g.pegasus_workflow_name %s;" % wf_filter_str
+
+        res = self.query(self.geoedf_cursor,get_wf_status_query_str,wf_filter_params)
 
+        # check to see if db_url still points to an existent file
+        # on workflow completion, the workflow db file is moved to the top level folder
+        # in workflow_dir
+        # db_url is of the form: sqlite:///<path>
         for row in res:
-            # check to see if db_url still points to an existent file
-            # on workflow completion, the workflow db file is moved to the top level folder
-            # in workflow_dir
-            # db_url is of the form: sqlite:///<path>
             dbpath = row['db_url'][10:]
             workflow_dbfname = os.path.split(dbpath)[1]
-            rundir = rundirs[dax_workflownames[row['dax_label']]]
+            rundir = row['workflow_rundir']
             if not os.path.isfile(dbpath):
                 # check to see if file can be found in top level workflow dir
                 dbpath = '%s/%s' % (rundir,workflow_dbfname)
                 if not os.path.isfile(dbpath):
-                    print("Workflow %s status cannot be determined; workflow tracking database is missing!!!" % dax_workflownames[row['dax_label']])
+                    print("Workflow %s status cannot be determined; workflow tracking database is missing!!!" % row['workflow_name'])
                     continue
                 else:
                     res_data = {}
-                    res_data['workflow_id'] = dax_workflownames[row['dax_label']]
+                    res_data['workflow_id'] = row['workflow_name']
                     res_data['workflow_dir'] = rundir
                     res_data['workflow_status'] = 'Workflow complete'
                     status_res.append(res_data)
@@ -296,7 +310,7 @@ class WorkflowDBHelper:
                 # if workflow is complete
                 if workflow_complete:
                     res_data = {}
-                    res_data['workflow_id'] = dax_workflownames[row['dax_label']]
+                    res_data['workflow_id'] = row['workflow_name']
                     res_data['workflow_dir'] = rundir
                     res_data['workflow_status'] = 'Workflow complete'
                     status_res.append(res_data)
@@ -305,7 +319,7 @@ class WorkflowDBHelper:
                     # report the first failed task
                     readable_taskname = self.human_readable_taskname(failed_tasks[0])
                     res_data = {}
-                    res_data['workflow_id'] = dax_workflownames[row['dax_label']]
+                    res_data['workflow_id'] = row['workflow_name']
                     res_data['workflow_dir'] = rundir
                     res_data['workflow_status'] = '%s failed' % readable_taskname
                     status_res.append(res_data)
@@ -314,13 +328,13 @@ class WorkflowDBHelper:
                     curr_task = self.get_current_task(executing_tasks,pending_tasks)
                     if curr_task is not None:
                         res_data = {}
-                        res_data['workflow_id'] = dax_workflownames[row['dax_label']]
+                        res_data['workflow_id'] = row['workflow_name']
                         res_data['workflow_dir'] = rundir
                         res_data['workflow_status'] = curr_task
                         status_res.append(res_data)
                     else:
                         res_data = {}
-                        res_data['workflow_id'] = dax_workflownames[row['dax_label']]
+                        res_data['workflow_id'] = row['workflow_name']
                         res_data['workflow_dir'] = rundir
                         res_data['workflow_status'] = 'Unknown'
                         status_res.append(res_data)
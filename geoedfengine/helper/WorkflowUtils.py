@@ -10,8 +10,11 @@ import sys
 import os
 import re
 import itertools
-import subprocess
 import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from shutil import which
 from getpass import getpass
 from ..GeoEDFConfig import GeoEDFConfig
 from .SubmitBroker import SubmitBroker
@@ -26,39 +29,84 @@ from sregistry.main import get_client
 
 from .GeoEDFError import GeoEDFError
 
+# patterns for variables: %{var} and stage references: $#
+# compiled once at module load since they are used for every plugin arg
+_VAR_RE = re.compile(r'%\{([^}]+)\}')
+_STAGE_RE = re.compile(r'\$([0-9]+)')
+
+# the same binding strings tend to recur across plugin args and instances
+# so the parsed results are cached, keyed by the string itself
+# tuples are returned so that cached results cannot be modified by callers
+@lru_cache(maxsize=4096)
+def _find_dependent_vars(value):
+    return tuple(_VAR_RE.findall(value))
+
+@lru_cache(maxsize=4096)
+def _find_stage_refs(value):
+    return tuple(_STAGE_RE.findall(value))
+
+# finds the local path to an executable by searching PATH
+# results are cached since the same few executables are looked up for every workflow
+@lru_cache(maxsize=None)
+def _find_local_exec(exec_name):
+    exec_path = which(exec_name)
+    if exec_path is None:
+        raise GeoEDFError("Error occurred in finding the executable %s. This should not happen if the workflow engine was successfully installed!!!" % exec_name)
+    return exec_path
+
+# longest path accepted by the OS; longer strings cannot be local files
+try:
+    PATH_MAX = os.pathconf('/','PC_PATH_MAX')
+except (AttributeError,OSError,ValueError):
+    PATH_MAX = 4096
+
+# containers found in the registry are cached for this many seconds
+# the registry is otherwise queried again for every workflow that is built
+REGISTRY_CACHE_TTL = 300
+_registry_containers = None
+_registry_fetch_time = None
+
+# loader used to parse workflow YAML files
+# the libyaml based C loader is used when PyYAML has been built with it
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
+# results of analyzing the bindings of a plugin definition in a single pass
+PluginAnalysis = namedtuple('PluginAnalysis',['var_deps','stage_refs','dir_mod_refs','local_file_binds','empty_args'])
+
 class WorkflowUtils:
 
+    # reuse the config parsed at module load rather than re-reading the file
     def __init__(self):
-        self.cfg = GeoEDFConfig()
+        self.cfg = geoedf_cfg
 
-    # generate a unique ID based on the epoch time
+    # generate a unique ID based on the epoch time (in microseconds) and process ID
+    # so that workflows created in the same second do not collide
     # the ID is used as a suffix for all workflow and job directories
     def gen_workflow_id(self):
-        self.workflow_id = str(int(time.time()))
+        self.workflow_id = '%d-%d' % (int(time.time() * 1000000),os.getpid())
         return self.workflow_id
 
-    # finds the path to an executable by running "which"
+    # finds the path to an executable by searching PATH
     def find_exec_path(self,exec_name,target='condorpool'):
-        try:
-            # for local and condor execution, find local path
-            if target == 'condorpool' or target == 'local':
+        # for local and condor execution, find local path
+        if target == 'condorpool' or target == 'local':
+            ret = dict()
+            ret['exec_path'] = _find_local_exec(exec_name)
+            ret['python_path'] = os.getenv('PYTHONPATH')
+            return ret
+        else: # need to determine path on submit host since that is the "local" site
+            # if submit configuration is provided, determine path from there
+            if 'submit' in self.cfg.config:
                 ret = dict()
-                exec_path = subprocess.check_output(["which",exec_name])
-                ret['exec_path'] = exec_path.decode('utf-8').rstrip()
-                ret['python_path'] = os.getenv('PYTHONPATH')
+                exec_path = os.path.join(self.cfg.config['submit']['exec_path'],exec_name)
+                ret['exec_path'] = exec_path
+                ret['python_path'] = self.cfg.config['submit']['python_path']
                 return ret
-            else: # need to determine path on submit host since that is the "local" site
-                # if submit configuration is provided, determine path from there
-                if 'submit' in self.cfg.config:
-                    ret = dict()
-                    exec_path = '%s/%s' % (self.cfg.config['submit']['exec_path'],exec_name)
-                    ret['exec_path'] = exec_path
-                    ret['python_path'] = self.cfg.config['submit']['python_path']
-                    return ret
-                else:
-                    raise GeoEDFError("Submit execution path not provided in config; this is required for non-local executions")
-        except subprocess.CalledProcessError:
-            raise GeoEDFError("Error occurred in finding the executable %s. This should not happen if the workflow engine was successfully installed!!!" % exec_name)
+            else:
+                raise GeoEDFError("Submit execution path not provided in config; this is required for non-local executions")
 
     # determine fully qualified path to job directory for given execution target
     def target_job_dir(self,target):
@@ -68,7 +116,7 @@ class WorkflowUtils:
         else:
             if self.cfg.config is not None:
                 site_scratch_path = self.cfg.config[target]['scratch_path']
-                return '%s/%s' % (site_scratch_path,self.workflow_id)
+                return os.path.join(site_scratch_path,self.workflow_id)
             else:
                 raise GeoEDFError("Config file not present, cannot determine appropriate job directory on execution host")
 
@@ -90,13 +138,13 @@ class WorkflowUtils:
     def create_run_dir(self):
         # create under home directory
         if os.getenv('HOME') is not None:
-            full_path = '%s/geoedf/workflows/%s' % (os.getenv('HOME'),self.workflow_id)
+            full_path = os.path.join(os.getenv('HOME'),'geoedf','workflows',self.workflow_id)
             try:
-                mkdir_proc = subprocess.call(["mkdir","-p",full_path])
+                os.makedirs(full_path,exist_ok=True)
                 # set environment variable
                 os.environ["RUN_DIR"] = full_path
                 return full_path
-            except subprocess.CalledProcessError:
+            except OSError:
                 raise GeoEDFError("Error occurred in creating run directory for this workflow!!!")
         else:
            raise GeoEDFError("Could not determine user home directory; cannot create workflow directory!!!")        
@@ -106,57 +154,43 @@ class WorkflowUtils:
     # this function only performs a cursory syntactic check
     def validate_workflow(self,workflow_dict):
         # ensure that workflow stages are numeric and in order
-        workflow_stages = list(workflow_dict.keys())
-
         # find number of stages; each $n needs to be present
-        num_stages = len(workflow_stages)
+        num_stages = len(workflow_dict)
 
-        for stage_num in range(1,num_stages+1):
-            stage_id = '$%d' % stage_num
-            if stage_id not in workflow_stages:
-                raise GeoEDFError('Workflow stages need to be in numeric order and of the form $n')
+        expected_stages = set(['$%d' % stage_num for stage_num in range(1,num_stages+1)])
+        if set(workflow_dict.keys()) != expected_stages:
+            raise GeoEDFError('Workflow stages need to be in numeric order and of the form $n')
 
     # parses a string to find the mentioned variables: %{var}
+    # returns a tuple of variable names
     def find_dependent_vars(self,value):
-        if value is not None and isinstance(value, str):
-            return re.findall('\%\{(.+)\}',value)
+        if isinstance(value,str):
+            return _find_dependent_vars(value)
         else:
-            return []
+            return ()
 
     # parses a string to find stage references: $#
+    # returns a tuple of stage numbers (as strings)
     def find_stage_refs(self,value):
-        if value is not None and isinstance(value,str):
-            return re.findall('\$([0-9]+)',value)
+        if isinstance(value,str):
+            return _find_stage_refs(value)
         else:
-            return []
+            return ()
 
     # checks to make sure value is of format dir(dir(....$n)...)
-    # could have used a parser here, instead do a lazy recursive check
-    # will work first time since we only call if starts with dir(
+    # peels off one dir( ... ) wrapper at a time; what remains has to be the kernel
+    # at least one dir modifier needs to be present
     def validate_dir_modifiers(self,value,kernel):
-        subexp = re.findall('dir\((.+)\)',value)
-        # needs to be exactly one or equal to kernel
-        if len(subexp) > 0:
-            if len(subexp) > 1:
-                return False
-            else: # exactly one
-                # first ensure this is the right subexpression
-                reconstruction = 'dir(%s)' % subexp[0]
-                if value != reconstruction:
-                    return False
-                if subexp[0].startswith('dir('): #recurse
-                    return self.validate_dir_modifiers(subexp[0],kernel)
-                else:
-                    if subexp[0] != kernel:
-                        return False
-                    return True
-        else:
-            return False
+        num_modifiers = 0
+        while value.startswith('dir(') and value.endswith(')'):
+            value = value[4:-1]
+            num_modifiers += 1
+        return num_modifiers > 0 and value == kernel
 
     # validates stage refs (if they exist) in value
     # only allows exactly one stage ref and zero or more dir modifiers
     def validate_stage_refs(self,value):
-        if value is not None and isinstance(value,str):
+        if isinstance(value,str):
             # first find the stage refs
             stage_refs = self.find_stage_refs(value)
             if len(stage_refs) > 0: #stage refs exist
@@ -176,180 +210,144 @@ class WorkflowUtils:
     # collect var dependencies for a plugin instance
     # finds binding values for each argument (key in dict) and extracts variables
     def collect_var_dependencies(self,plugin_def):
-        var_deps = []
-        for plugin_class in plugin_def.keys():
-            plugin_inst = plugin_def[plugin_class]
-            for arg in plugin_inst.keys():
-                val = plugin_inst[arg]
-                val_vars = self.find_dependent_vars(val)
-                var_deps = list(set(var_deps).union(set(val_vars)))
-        return var_deps
+        return self.analyze_plugin(plugin_def).var_deps
 
     # collects stage references in a plugin instance
     def collect_stage_refs(self,plugin_def):
-        refs = []
-        for plugin_class in plugin_def.keys():
-            plugin_inst = plugin_def[plugin_class]
-            for arg in plugin_inst.keys():
-                val = plugin_inst[arg]
-                val_stage_refs = self.find_stage_refs(val)
-                refs = list(set(refs).union(set(val_stage_refs)))
-        return refs
+        return self.analyze_plugin(plugin_def).stage_refs
 
     # collect the stage references who have a dir modifier applied
     # in this plugin's bindings
     def collect_dir_modified_refs(self, plugin_def):
-        dir_mod_refs = []
-        for plugin_class in plugin_def.keys():
-            plugin_inst = plugin_def[plugin_class]
-            for arg in plugin_inst.keys():
-                val = plugin_inst[arg]
-                if val is not None and isinstance(val,str):
-                    if val.startswith('dir('):
-                        # find the stage references in this value
-                        val_stage_refs = self.find_stage_refs(val)
-                        dir_mod_refs = list(set(dir_mod_refs).union(set(val_stage_refs)))
-        return dir_mod_refs
+        return self.analyze_plugin(plugin_def).dir_mod_refs
 
     # uses naive identification of local files - either has an extension or / separator
     # checks to see if these are actually files on this host and add to dictionary
+    # strings that cannot be a path are rejected before checking the filesystem
     def is_local_file(self,val_str):
-        if '.' in val_str or '/' in val_str: # hardcoded path separator
-            if os.path.isfile(val_str):
-                return True
-        return False
+        if not val_str or ('/' not in val_str and '.' not in val_str): # hardcoded path separator
+            return False
+        if len(val_str) > PATH_MAX or '\x00' in val_str:
+            return False
+        return os.path.isfile(val_str)
 
     # collects args bound to local files
     def collect_local_file_bindings(self,plugin_def):
-        file_binds = dict()
-        for plugin_class in plugin_def.keys():
-            plugin_inst = plugin_def[plugin_class]
-            for arg in plugin_inst.keys():
-                val = plugin_inst[arg]
-                if isinstance(val,str) and self.is_local_file(val): #lazy eval
-                    file_binds[arg] = val
-        return file_binds
+        return self.analyze_plugin(plugin_def).local_file_binds
 
     # collects args with empty bindings
     def collect_empty_bindings(self,plugin_def):
+        return self.analyze_plugin(plugin_def).empty_args
+
+    # analyzes a plugin instance's bindings in a single traversal
+    # collects the var dependencies, stage refs, dir modified refs,
+    # local file bindings, and empty bindings; the collect_ methods return one of these
+    # returns a PluginAnalysis
+    def analyze_plugin(self,plugin_def):
+        var_deps = set()
+        refs = set()
+        dir_mod_refs = set()
+        file_binds = dict()
         empty_args = []
         for plugin_class in plugin_def.keys():
             plugin_inst = plugin_def[plugin_class]
             for arg in plugin_inst.keys():
                 val = plugin_inst[arg]
-                if val is None:
-                    empty_args.append(arg)
-                else:
-                    if isinstance(val,str) and (len(val) == 0):
+                if isinstance(val,str):
+                    if not val:
                         empty_args.append(arg)
-        return empty_args
+                        continue
+                    var_deps.update(_find_dependent_vars(val))
+                    val_stage_refs = _find_stage_refs(val)
+                    refs.update(val_stage_refs)
+                    if val.startswith('dir('):
+                        dir_mod_refs.update(val_stage_refs)
+                    if self.is_local_file(val):
+                        file_binds[arg] = val
+                elif val is None:
+                    empty_args.append(arg)
+        return PluginAnalysis(list(var_deps),list(refs),list(dir_mod_refs),file_binds,empty_args)
 
     # converts a list into a comma separated string
     def list_to_str(self,val_list):
         if len(val_list) > 0:
-            ret_str = '%s' % val_list[0]
-            for val in val_list[1:]:
-                ret_str = '%s,%s' % (ret_str,val)
-            return ret_str
+            return ','.join(map(str,val_list))
         else:
            return 'None'
 
+    # generates binding combinations from two dictionaries of binding lists
+    # yields pairs of dictionaries, one combination at a time
+    # iter_binding_combs({'a':[1,2],'b':[3,4]},{1:[a,b],2:[d,e]})
+    # => ({'a':1,'b':3},{1:a,2:d}),({'a':1,'b':3},{1:a,2:e}),...
+    # also works with just dict1 provided, yielding dicts
+    # keys of dict2 in dict2_unary_keys are bound to just their first value
+    def iter_binding_combs(self,dict1,dict2=None,dict2_unary_keys=()):
+        if dict1 is not None and dict2 is not None:
+            # first get a listing of keys and values (in the same order) to convert back into dicts
+            keys1, dict1_vals = list(dict1), list(dict1.values())
+            keys2 = list(dict2)
+            # if key is to be overridden, modify values
+            dict2_vals = [vals[:1] if key in dict2_unary_keys else vals for (key,vals) in dict2.items()]
+
+            # take a single cross product over the values of both dictionaries
+            # and split each combination back into a pair of dictionaries
+            num_keys1 = len(keys1)
+            for comb in itertools.product(*dict1_vals,*dict2_vals):
+                yield (dict(zip(keys1,comb[:num_keys1])),dict(zip(keys2,comb[num_keys1:])))
+        # if only one dict provided, yield dicts
+        elif dict1 is not None:
+            # first get a listing of keys and values (in the same order) to convert back into dict
+            keys1, dict1_vals = list(dict1), list(dict1.values())
+
+            for comb in itertools.product(*dict1_vals):
+                yield dict(zip(keys1,comb))
+
     # creates binding combinations from two dictionaries of binding lists
     # will return an array of pairs of dictionaries
     # binding_combs({'a':[1,2],'b':[3,4]},{1:[a,b],2:[d,e]})
-    # => [[{'a':1,'b':3},{1:a,2:d}],[{'a':1,'b':4},{1:a,2:d}],...]
+    # => [[{'a':1,'b':3},{1:a,2:d}],[{'a':1,'b':3},{1:a,2:e}],...]
     # also works with just dict1 provided
-    def create_binding_combs(self,dict1,dict2):
-        if dict1 is not None and dict2 is not None:
-            # first get a listing of key to convert back into dict
-            keys1 = list(dict1.keys())
-            keys2 = list(dict2.keys())
-
-            # get a cross product of first dictionary
-            dict1_vals = []
-            for key in keys1:
-                dict1_vals.append(dict1[key])
-
-            dict1_combs = list(itertools.product(*list(dict1_vals)))
-
-            # get a cross product of the 2nd dictionary
-            dict2_vals = []
-            for key in keys2:
-                # if key is to be overridden, modify values
-                if key in dict2_unary_keys:
-                    dict2_vals.append([dict2[key][0]])
-                else:
-                    dict2_vals.append(dict2[key])
-
-            dict2_combs = list(itertools.product(*list(dict2_vals)))
-
-            # now combine the two
-            dict1_dict2_combs = list(itertools.product(dict1_combs,dict2_combs))
-
-            # now convert this into a list of pairs of dictionaries
-            binding_combs = []
-            for comb_pair in dict1_dict2_combs:
-                dict1_inst = dict()
-                dict2_inst = dict()
-                for indx in range(0,len(keys1)):
-                    dict1_inst[keys1[indx]] = comb_pair[0][indx]
-                for indx in range(0,len(keys2)):
-                    dict2_inst[keys2[indx]] = comb_pair[1][indx]
-                binding_combs.append((dict1_inst,dict2_inst))
-            return binding_combs
-        # if only one dict provided, return array of dicts
-        elif dict1 is not None:
-            # first get a listing of key to convert back into dict
-            keys1 = list(dict1.keys())
-
-            # get a cross product of the dictionary
-            dict1_vals = []
-            for key in keys1:
-                dict1_vals.append(dict1[key])
-                
-            dict1_combs = list(itertools.product(*list(dict1_vals)))
-
-            # now convert this into a list of dictionaries
-            binding_combs = []
-            for comb_pair in dict1_combs:
-                dict1_inst = dict()
-                for indx in range(0,len(keys1)):
-                    dict1_inst[keys1[indx]] = comb_pair[indx]
-                binding_combs.append(dict1_inst)
-            return binding_combs
+    def create_binding_combs(self,dict1,dict2=None,dict2_unary_keys=()):
+        return list(self.iter_binding_combs(dict1,dict2,dict2_unary_keys))
 
     # function that prompts the user for values for sensitive args
     # returns a JSON with arg-value bindings
     # uses stage_num, plugin_name to assist user
     def collect_sensitive_arg_binds(self,stage_num,plugin_name,args):
-        arg_binds = dict()
         plugin_prompt = 'plugin %s in workflow stage %d' % (plugin_name,stage_num)
-        for arg in args:
-            arg_prompt = 'Enter value for %s in %s: ' % (arg,plugin_prompt)
-            arg_binds[arg] = getpass(prompt=arg_prompt)
-        return arg_binds
+        return {arg: getpass(prompt='Enter value for %s in %s: ' % (arg,plugin_prompt)) for arg in args}
+
+    # function that searches a collection in the Singularity registry server
+    # returns a dictionary mapping plugin name to the first container URI found for it
+    # uses its own registry client so that collections can be searched concurrently
+    def search_registry_collection(self,collection_name):
+        cli = get_client(quiet=True)
+        containers = dict()
+        # container URIs are of the form collection/plugin:tag
+        for (cont_uri,url) in cli.search(collection_name):
+            plugin_name = cont_uri.split(':',1)[0].split('/',2)[1]
+            containers.setdefault(plugin_name,cont_uri)
+        return containers
 
     # function that queries the Singularity registry server for containers
     # in the connector and processor collections
     # returns names and URI in separate dictionaries
+    # results are cached for REGISTRY_CACHE_TTL seconds
     def get_registry_containers(self):
-        cli = get_client(quiet=True)
+        global _registry_containers, _registry_fetch_time
+
+        if _registry_containers is not None and (time.monotonic() - _registry_fetch_time) < REGISTRY_CACHE_TTL:
+            return _registry_containers
+
+        # the two searches are independent network round-trips, so run them concurrently
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            conns_future = executor.submit(self.search_registry_collection,"connectors")
+            procs_future = executor.submit(self.search_registry_collection,"processors")
+            conns = conns_future.result()
+            procs = procs_future.result()
 
-        conns = dict()
-        query_res = cli.search("connectors")
-        for (cont_uri,url) in query_res:
-            cont_path = cont_uri.split(':')[0]
-            plugin_name = cont_path.split('/')[1]
-            if plugin_name not in conns:
-                conns[plugin_name] = cont_uri
-
-        procs = dict()
-        query_res = cli.search("processors")
-        for (cont_uri,url) in query_res:
-            cont_path = cont_uri.split(':')[0]
-            plugin_name = cont_path.split('/')[1]
-            if plugin_name not in procs:
-                procs[plugin_name] = cont_uri
+        _registry_containers = (conns,procs)
+        _registry_fetch_time = time.monotonic()
 
         return (conns,procs)
 